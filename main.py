@@ -1,31 +1,96 @@
 import os
-import json
+import random
+import hashlib
+import sqlite3
+import asyncio
+import aiohttp
 import requests
 import pandas as pd
 import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from vnstock3 import Vnstock
 import time
-import schedule
 from vnstock import *
 
+try:
+    import talib
+except ImportError:
+    talib = None  # Fall back to the pandas implementations below
+
+try:
+    import numba
+except ImportError:
+    numba = None  # Fall back to TA-Lib/pandas below
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None  # Fall back to the pandas boolean mask below
+
 # Configuration
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
-STATE_FILE = 'stock_state.json'
+STATE_DB = 'stock_state.db'
+CACHE_DIR = 'cache'  # Per-symbol OHLC parquet cache topped up incrementally
+HISTORY_DAYS = 90
+MIN_AVG_TURNOVER = 20_000_000_000  # > 20 billion VND average daily turnover
+LIQUID_UNIVERSE_FILE = 'liquid_universe.parquet'
+LIQUID_UNIVERSE_TTL = 86400  # Re-check the full universe for liquidity daily
+TELEGRAM_MAX_CHARS = 4000  # Telegram caps messages at 4096; keep some margin
+SCREEN_INTERVAL = 4 * 3600  # Run a screening cycle every 4 hours
+MAX_WORKERS = 24  # Concurrent fetch threads (fetching is I/O-bound)
+MAX_REQUESTS_PER_SECOND = 10  # Global cap to stay under the API rate limit
+UNIVERSE_FILE = 'universe.parquet'
+UNIVERSE_TTL = 86400  # New listings are rare; refresh the ticker list daily
+FETCH_RETRIES = 3  # Attempts per symbol before a fetch counts as failed
+
+# Sentinel returned by fetch_history when the network call failed and no
+# cached bars could stand in; distinct from None (genuinely too little data)
+FETCH_FAILED = object()
+
+
+class RateLimiter:
+    """Spread requests evenly so concurrent fetch threads stay under a global QPS cap"""
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter(MAX_REQUESTS_PER_SECOND)
 
-# List of stocks to screen (Vietnam market)
-STOCK_UNIVERSE = listing_companies()['ticker'].tolist()
+
+def wilder_rma(data, period):
+    """Wilder's smoothed moving average: EMA with alpha=1/period, seeded with an SMA"""
+    seeded = data.copy()
+    # Wilder initializes the recursion with a plain average of the first
+    # `period` values; from there each bar applies rma = rma + (x - rma)/period
+    seeded.iloc[:period + 1] = data.rolling(window=period).mean().iloc[:period + 1]
+    return seeded.ewm(alpha=1.0 / period, adjust=False).mean()
 
 
 def calculate_rsi(data, period=14):
-    """Calculate RSI indicator"""
+    """Calculate RSI indicator (Wilder's smoothing, matches TradingView/TA-Lib)"""
     delta = data.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
+    gain = wilder_rma(delta.clip(lower=0), period)
+    loss = wilder_rma(-delta.clip(upper=0), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
     rsi = 100 - (100 / (1 + rs))
-    return rsi
+    # A zero average loss (pure uptrend window) must saturate RSI at 100
+    # instead of leaking inf/NaN into the screening predicate
+    return rsi.mask(loss == 0, 100.0)
 
 
 def calculate_ema(data, period):
@@ -33,175 +98,516 @@ def calculate_ema(data, period):
     return data.ewm(span=period, adjust=False).mean()
 
 
-def get_stock_data(symbol):
-    """Fetch stock data and calculate indicators"""
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _indicator_kernel(closes, rsi_period, ema20_span, ema50_span):
+        """RSI/EMA20/EMA50 over a (dates, symbols) array, one core per symbol batch"""
+        n_rows, n_cols = closes.shape
+        rsi = np.full((n_rows, n_cols), np.nan)
+        ema20 = np.full((n_rows, n_cols), np.nan)
+        ema50 = np.full((n_rows, n_cols), np.nan)
+        a20 = 2.0 / (ema20_span + 1.0)
+        a50 = 2.0 / (ema50_span + 1.0)
+
+        for j in numba.prange(n_cols):
+            # Recently listed symbols have leading NaNs in the wide frame
+            start = 0
+            while start < n_rows and np.isnan(closes[start, j]):
+                start += 1
+            if start >= n_rows:
+                continue
+
+            ema20[start, j] = closes[start, j]
+            ema50[start, j] = closes[start, j]
+            for i in range(start + 1, n_rows):
+                ema20[i, j] = a20 * closes[i, j] + (1.0 - a20) * ema20[i - 1, j]
+                ema50[i, j] = a50 * closes[i, j] + (1.0 - a50) * ema50[i - 1, j]
+
+            # Wilder RSI: SMA seed over the first `rsi_period` changes, then
+            # the smoothed recurrence avg = (avg*(n-1) + x)/n
+            if n_rows - start <= rsi_period:
+                continue
+            avg_gain = 0.0
+            avg_loss = 0.0
+            for i in range(start + 1, start + rsi_period + 1):
+                delta = closes[i, j] - closes[i - 1, j]
+                if delta > 0:
+                    avg_gain += delta
+                else:
+                    avg_loss -= delta
+            avg_gain /= rsi_period
+            avg_loss /= rsi_period
+            if avg_loss == 0.0:
+                rsi[start + rsi_period, j] = 100.0
+            else:
+                rsi[start + rsi_period, j] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+            for i in range(start + rsi_period + 1, n_rows):
+                delta = closes[i, j] - closes[i - 1, j]
+                gain = delta if delta > 0 else 0.0
+                loss = -delta if delta < 0 else 0.0
+                avg_gain = (avg_gain * (rsi_period - 1) + gain) / rsi_period
+                avg_loss = (avg_loss * (rsi_period - 1) + loss) / rsi_period
+                if avg_loss == 0.0:
+                    rsi[i, j] = 100.0
+                else:
+                    rsi[i, j] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+        return rsi, ema20, ema50
+
+
+def compute_indicators(close_df):
+    """Compute RSI/EMA20/EMA50 for all symbols; numba > TA-Lib > pandas"""
+    wrap = lambda a: pd.DataFrame(a, index=close_df.index, columns=close_df.columns)
+
+    if numba is not None:
+        closes = np.ascontiguousarray(close_df.to_numpy(dtype=np.float64))
+        rsi, ema20, ema50 = _indicator_kernel(closes, 14, 20, 50)
+        return wrap(rsi), wrap(ema20), wrap(ema50)
+
+    if talib is None:
+        return (calculate_rsi(close_df),
+                calculate_ema(close_df, 20),
+                calculate_ema(close_df, 50))
+
+    closes = close_df.to_numpy(dtype=np.float64)
+    rsi = np.full_like(closes, np.nan)
+    ema20 = np.full_like(closes, np.nan)
+    ema50 = np.full_like(closes, np.nan)
+    for i in range(closes.shape[1]):
+        col = closes[:, i]
+        # Symbols with 50-89 bars have leading NaNs in the wide frame (ffill
+        # only fills forward) and TA-Lib propagates NaN through its whole
+        # recursion; start past them like the numba kernel does
+        valid = np.flatnonzero(~np.isnan(col))
+        if len(valid) == 0:
+            continue
+        start = valid[0]
+        rsi[start:, i] = talib.RSI(col[start:], timeperiod=14)
+        ema20[start:, i] = talib.EMA(col[start:], timeperiod=20)
+        ema50[start:, i] = talib.EMA(col[start:], timeperiod=50)
+
+    return wrap(rsi), wrap(ema20), wrap(ema50)
+
+
+def load_cached_history(symbol):
+    """Load the cached OHLC frame for a symbol, or None if absent/unreadable"""
+    cache_path = os.path.join(CACHE_DIR, f"{symbol}.parquet")
     try:
-        stock = Vnstock().stock(symbol=symbol, source='VCI')
-        
-        # Get historical data (60 days to calculate indicators properly)
-        end_date = datetime.now().strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-        
-        df = stock.quote.history(start=start_date, end=end_date, interval='1D')
-        
-        if df is None or len(df) < 50:
-            return None
-        
-        # Calculate indicators
-        df['RSI'] = calculate_rsi(df['close'])
-        df['EMA20'] = calculate_ema(df['close'], 20)
-        df['EMA50'] = calculate_ema(df['close'], 50)
-        df['Turnover'] = df['close'] * df['volume']
-        
-        # Get last 20 days average turnover
-        avg_turnover_20 = df['Turnover'].tail(20).mean()
-        
-        # Get latest values
-        latest = df.iloc[-1]
-        current_price = latest['close']
-        rsi = latest['RSI']
-        ema20 = latest['EMA20']
-        ema50 = latest['EMA50']
-        
-        # Calculate percentages
-        price_vs_ema20 = ((current_price - ema20) / ema20) * 100
-        ema20_vs_ema50 = ((ema20 - ema50) / ema50) * 100
-        
-        return {
-            'symbol': symbol,
-            'price': round(current_price, 2),
-            'rsi': round(rsi, 2),
-            'ema20': round(ema20, 2),
-            'ema50': round(ema50, 2),
-            'avg_turnover': round(avg_turnover_20, 2),
-            'price_vs_ema20': round(price_vs_ema20, 2),
-            'ema20_vs_ema50': round(ema20_vs_ema50, 2)
-        }
+        if os.path.exists(cache_path):
+            return pd.read_parquet(cache_path)
+    except Exception as e:
+        print(f"Error reading cache for {symbol}: {e}")
+    return None
+
+
+def save_cached_history(symbol, df):
+    """Persist a symbol's OHLC frame to the cache"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(os.path.join(CACHE_DIR, f"{symbol}.parquet"))
+    except Exception as e:
+        print(f"Error writing cache for {symbol}: {e}")
+
+
+def load_universe():
+    """List of stocks to screen (Vietnam market), cached across restarts"""
+    try:
+        if (os.path.exists(UNIVERSE_FILE) and
+                time.time() - os.path.getmtime(UNIVERSE_FILE) < UNIVERSE_TTL):
+            return pd.read_parquet(UNIVERSE_FILE)['ticker'].tolist()
+    except Exception as e:
+        print(f"Error loading cached universe: {e}")
+
+    companies = listing_companies()
+    try:
+        companies[['ticker']].to_parquet(UNIVERSE_FILE)
+    except Exception as e:
+        print(f"Error caching universe: {e}")
+    return companies['ticker'].tolist()
+
+
+def load_liquid_universe():
+    """Load the cached set of liquid symbols, or None when missing/stale"""
+    try:
+        if (os.path.exists(LIQUID_UNIVERSE_FILE) and
+                time.time() - os.path.getmtime(LIQUID_UNIVERSE_FILE) < LIQUID_UNIVERSE_TTL):
+            return pd.read_parquet(LIQUID_UNIVERSE_FILE)['symbol'].tolist()
+    except Exception as e:
+        print(f"Error loading liquid universe: {e}")
+    return None
+
+
+def save_liquid_universe(symbols):
+    """Persist the set of symbols worth fetching on intraday cycles"""
+    try:
+        pd.DataFrame({'symbol': list(symbols)}).to_parquet(LIQUID_UNIVERSE_FILE)
+    except Exception as e:
+        print(f"Error saving liquid universe: {e}")
+
+
+def _fetch_history_remote(symbol, start_date, end_date):
+    """Issue the history request, retrying transient network errors with
+    jittered exponential backoff"""
+    for attempt in range(FETCH_RETRIES):
+        try:
+            RATE_LIMITER.acquire()
+            # Each thread builds its own client: Vnstock.stock() stores the
+            # symbol on the instance, so sharing one across threads races
+            stock = Vnstock().stock(symbol=symbol, source='VCI')
+            return stock.quote.history(start=start_date, end=end_date, interval='1D')
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt == FETCH_RETRIES - 1:
+                raise
+            backoff = min(10.0, 2 ** attempt + random.uniform(0, 1))
+            print(f"Retrying {symbol} in {backoff:.1f}s: {e}")
+            time.sleep(backoff)
+
+
+def fetch_history(symbol):
+    """Fetch raw OHLC history for one symbol, topping up the cache incrementally.
+
+    Returns the frame, None when the symbol has too little data to screen,
+    or FETCH_FAILED when the fetch failed and no cache could stand in."""
+    cached = load_cached_history(symbol)
+
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    if cached is not None:
+        # Re-fetch from the last cached bar onward: the newest bar is the
+        # current day's partial one, which must be refreshed every intraday
+        # cycle rather than treated as final
+        start_date = cached.index[-1].strftime('%Y-%m-%d')
+        cached = cached.iloc[:-1]
+    else:
+        start_date = (datetime.now() - timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d')
+
+    fetch_failed = False
+    try:
+        df = None
+        if start_date <= end_date:
+            df = _fetch_history_remote(symbol, start_date, end_date)
+            if df is not None and len(df) > 0:
+                df = df.set_index('time')
     except Exception as e:
         print(f"Error fetching {symbol}: {e}")
-        return None
+        fetch_failed = True
+        df = None
+
+    if cached is not None:
+        df = cached if df is None or len(df) == 0 else pd.concat([cached, df])
+
+    if df is None or len(df) < 50:
+        # A failed fetch is not a data-quality skip: the caller keeps the
+        # symbol's previous state instead of reporting a spurious dropout
+        return FETCH_FAILED if fetch_failed and df is None else None
+
+    # Keep a rolling window so the cache doesn't grow unbounded
+    df = df[df.index >= datetime.now() - timedelta(days=HISTORY_DAYS)]
+    save_cached_history(symbol, df)
+
+    return df
 
 
 def screen_stocks():
     """Screen stocks based on criteria"""
-    qualified_stocks = []
-    
     print(f"Starting stock screening at {datetime.now()}")
-    
-    for symbol in STOCK_UNIVERSE:
-        print(f"Screening {symbol}...")
-        data = get_stock_data(symbol)
-        
-        if data is None:
-            continue
-        
-        # Apply screening criteria
-        if (data['avg_turnover'] > 20_000_000_000 and  # > 20 billion VND
-            data['rsi'] > 50 and
-            0 <= data['price_vs_ema20'] <= 5 and
-            0 <= data['ema20_vs_ema50'] <= 7):
-            
-            qualified_stocks.append(data)
-            print(f"  ✓ {symbol} qualified")
-        
-        # Small delay to avoid rate limiting
-        time.sleep(0.5)
-    
-    return qualified_stocks
+
+    stock_universe = load_universe()
+
+    # Most of the universe fails the turnover bar every cycle; restrict
+    # intraday cycles to symbols that recently cleared it and only re-check
+    # the full universe once the liquidity cache goes stale (daily)
+    liquid_universe = load_liquid_universe()
+    if liquid_universe is not None:
+        liquid = set(liquid_universe)
+        universe = [s for s in stock_universe if s in liquid]
+        print(f"Liquidity pre-filter: {len(universe)}/{len(stock_universe)} symbols")
+    else:
+        universe = stock_universe
+
+    # Fetching is I/O-bound, so overlap the network waits across a thread pool;
+    # RATE_LIMITER keeps the combined request rate under the API limit. Frames
+    # are consumed as each future completes, so the Python-side result handling
+    # runs while the remaining fetches are still in flight instead of after
+    # the whole batch has finished
+    raw = {}
+    failed_symbols = set()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(fetch_history, sym): sym for sym in universe}
+        for future in as_completed(futures):
+            sym = futures[future]
+            df = future.result()
+            if df is FETCH_FAILED:
+                failed_symbols.add(sym)
+            elif df is not None:
+                # Keep only the columns the screen consumes
+                raw[sym] = df[['close', 'volume']]
+
+    if not raw:
+        return pd.DataFrame(columns=list(STATE_COLUMNS)), failed_symbols
+
+    # One wide frame per field (rows=dates, cols=symbols): each indicator is
+    # then a single pandas pass over all columns instead of one call per symbol.
+    # float32 halves the bytes streamed through the indicator pass; prices fit
+    # comfortably in its ~7 significant digits (TA-Lib and the numba kernel
+    # convert back to float64 themselves)
+    close_df = (pd.DataFrame({sym: df['close'] for sym, df in raw.items()})
+                .ffill().astype(np.float32))
+    volume_df = pd.DataFrame({sym: df['volume'] for sym, df in raw.items()}).astype(np.float32)
+
+    rsi, ema20, ema50 = compute_indicators(close_df)
+
+    # Latest values per symbol
+    price = close_df.iloc[-1]
+    last_rsi = rsi.iloc[-1]
+
+    # Guard against the float32/backends round-trip pushing RSI out of its
+    # band; anything outside [0, 100] means an indicator bug upstream
+    out_of_band = last_rsi[(last_rsi < 0) | (last_rsi > 100)]
+    if len(out_of_band) > 0:
+        print(f"⚠️  RSI outside [0, 100] for: {', '.join(out_of_band.index)}")
+    last_ema20 = ema20.iloc[-1]
+    last_ema50 = ema50.iloc[-1]
+    # Only the last 20 bars feed the turnover average, so reduce the raw tail
+    # arrays directly instead of building aligned frames for the product.
+    # Turnover runs in the 1e10 range, past float32 precision, so widen first
+    turnover_tail = (close_df.values[-20:].astype(np.float64) *
+                     volume_df.values[-20:].astype(np.float64))
+    avg_turnover = pd.Series(np.nanmean(turnover_tail, axis=0), index=close_df.columns)
+
+    price_vs_ema20 = ((price - last_ema20) / last_ema20) * 100
+    ema20_vs_ema50 = ((last_ema20 - last_ema50) / last_ema50) * 100
+
+    # After a full-universe pass, refresh the liquidity pre-filter; keep a
+    # 50% headroom so names approaching the bar are still re-checked intraday.
+    # Failed fetches must stay in the filter too: dropping them here would
+    # keep their carried-forward rows unfetchable for 24h, and the next
+    # cycle would report them as dropouts
+    if liquid_universe is None:
+        liquid = set(avg_turnover.index[avg_turnover > MIN_AVG_TURNOVER * 0.5])
+        save_liquid_universe(liquid | failed_symbols)
+
+    # One column per metric, one row per symbol: every downstream step
+    # (filter, diff, formatting, persistence) stays columnar
+    metrics = pd.DataFrame({
+        'price': price,
+        'rsi': last_rsi,
+        'ema20': last_ema20,
+        'ema50': last_ema50,
+        'avg_turnover': avg_turnover,
+        'price_vs_ema20': price_vs_ema20,
+        'ema20_vs_ema50': ema20_vs_ema50
+    })
+
+    # Apply screening criteria across all symbols at once
+    if numexpr is not None:
+        # numexpr fuses the whole predicate into one pass, avoiding the five
+        # intermediate boolean arrays the pandas expression allocates
+        mask = numexpr.evaluate(
+            "(turnover > turnover_min) & (rsi > 50)"
+            " & (pe20 >= 0) & (pe20 <= 5) & (e2050 >= 0) & (e2050 <= 7)",
+            local_dict={
+                'turnover': metrics['avg_turnover'].to_numpy(),
+                'rsi': metrics['rsi'].to_numpy(),
+                'pe20': metrics['price_vs_ema20'].to_numpy(),
+                'e2050': metrics['ema20_vs_ema50'].to_numpy(),
+                'turnover_min': MIN_AVG_TURNOVER
+            })
+    else:
+        mask = ((metrics['avg_turnover'] > MIN_AVG_TURNOVER) &
+                (metrics['rsi'] > 50) &
+                metrics['price_vs_ema20'].between(0, 5) &
+                metrics['ema20_vs_ema50'].between(0, 7))
+
+    qualified = (metrics[mask].round(2)
+                 .rename_axis('symbol').reset_index()
+                 .sort_values('symbol', ignore_index=True))
+
+    for symbol in qualified['symbol']:
+        print(f"  ✓ {symbol} qualified")
+
+    return qualified, failed_symbols
+
+
+STATE_COLUMNS = ('symbol', 'price', 'rsi', 'ema20', 'ema50',
+                 'avg_turnover', 'price_vs_ema20', 'ema20_vs_ema50')
+
+
+def _state_connection():
+    """Open the state database, creating the tables on first use"""
+    con = sqlite3.connect(STATE_DB)
+    con.execute("""CREATE TABLE IF NOT EXISTS qualified (
+                       symbol TEXT PRIMARY KEY,
+                       price REAL,
+                       rsi REAL,
+                       ema20 REAL,
+                       ema50 REAL,
+                       avg_turnover REAL,
+                       price_vs_ema20 REAL,
+                       ema20_vs_ema50 REAL
+                   )""")
+    con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return con
 
 
 def load_previous_state():
     """Load previous screening state"""
     try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, 'r') as f:
-                return json.load(f)
+        con = _state_connection()
+        qualified = pd.read_sql_query(
+            f"SELECT {', '.join(STATE_COLUMNS)} FROM qualified", con)
+        meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        con.close()
+        return {
+            'qualified_stocks': qualified,
+            'last_update': meta.get('last_update'),
+            'alert_key': meta.get('alert_key')
+        }
     except Exception as e:
         print(f"Error loading state: {e}")
-    
+
     return {
-        'qualified_stocks': [],
-        'last_update': None
+        'qualified_stocks': pd.DataFrame(columns=list(STATE_COLUMNS)),
+        'last_update': None,
+        'alert_key': None
     }
 
 
-def save_state(qualified_stocks):
+def save_state(qualified_stocks, alert_key=None):
     """Save current screening state"""
     try:
-        state = {
-            'qualified_stocks': qualified_stocks,
-            'last_update': datetime.now().isoformat()
-        }
-        with open(STATE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
+        con = _state_connection()
+        placeholders = ', '.join('?' * len(STATE_COLUMNS))
+        with con:  # one transaction, so the snapshot swap is atomic
+            con.execute("DELETE FROM qualified")
+            # sqlite3 cannot bind np.float32 (unlike np.float64, it is not a
+            # float subclass), so widen the metric columns before inserting
+            rows = qualified_stocks[list(STATE_COLUMNS)].astype(
+                {col: 'float64' for col in STATE_COLUMNS[1:]})
+            con.executemany(
+                f"INSERT INTO qualified ({', '.join(STATE_COLUMNS)}) VALUES ({placeholders})",
+                rows.itertuples(index=False, name=None))
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('last_update', ?)",
+                        (datetime.now().isoformat(),))
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('alert_key', ?)",
+                        (alert_key,))
+        con.close()
     except Exception as e:
         print(f"Error saving state: {e}")
 
 
-def send_telegram_message(message):
-    """Send message to Telegram"""
+def split_message(message, limit=TELEGRAM_MAX_CHARS):
+    """Split a message at the blank lines between stock blocks so each chunk
+    stays under Telegram's length limit without breaking an HTML tag"""
+    chunks = []
+    current = ''
+    for block in message.split('\n\n'):
+        if current and len(current) + 2 + len(block) > limit:
+            chunks.append(current)
+            current = block
+        else:
+            current = block if not current else current + '\n\n' + block
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _post_telegram_chunks(chunks):
+    """POST all chunks concurrently over one aiohttp session"""
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+    async with aiohttp.ClientSession() as session:
+        async def post(chunk):
+            payload = {
+                'chat_id': TELEGRAM_CHAT_ID,
+                'text': chunk,
+                'parse_mode': 'HTML'
+            }
+            async with session.post(url, json=payload) as response:
+                return response.status == 200
+
+        results = await asyncio.gather(*[post(chunk) for chunk in chunks])
+
+    return all(results)
+
+
+async def send_telegram_message(message):
+    """Send message to Telegram, chunked to respect the 4096-char limit"""
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Telegram credentials not set. Message not sent.")
         print(message)
         return False
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
-    payload = {
-        'chat_id': TELEGRAM_CHAT_ID,
-        'text': message,
-        'parse_mode': 'HTML'
-    }
-    
+
     try:
-        response = requests.post(url, json=payload)
-        return response.status_code == 200
+        return await _post_telegram_chunks(split_message(message))
     except Exception as e:
         print(f"Error sending Telegram message: {e}")
         return False
 
 
-def format_stock_table(stocks):
-    """Format stocks as a table for Telegram"""
-    if not stocks:
+def format_stock_table(df):
+    """Format a qualified-stock DataFrame as a table for Telegram"""
+    if len(df) == 0:
         return "No stocks"
-    
-    lines = []
-    for stock in stocks:
-        lines.append(
-            f"<b>{stock['symbol']}</b>\n"
-            f"  Price: {stock['price']:,.0f} VND\n"
-            f"  RSI: {stock['rsi']:.1f}\n"
-            f"  P/EMA20: +{stock['price_vs_ema20']:.2f}%\n"
-            f"  EMA20/50: +{stock['ema20_vs_ema50']:.2f}%\n"
-            f"  Turnover: {stock['avg_turnover']/1_000_000_000:.1f}B VND"
-        )
-    
-    return "\n\n".join(lines)
 
+    # Build all blocks with columnar string ops instead of a per-stock loop
+    blocks = (
+        '<b>' + df['symbol'] + '</b>\n'
+        '  Price: ' + df['price'].map('{:,.0f}'.format) + ' VND\n'
+        '  RSI: ' + df['rsi'].map('{:.1f}'.format) + '\n'
+        '  P/EMA20: +' + df['price_vs_ema20'].map('{:.2f}'.format) + '%\n'
+        '  EMA20/50: +' + df['ema20_vs_ema50'].map('{:.2f}'.format) + '%\n'
+        '  Turnover: ' + (df['avg_turnover'] / 1_000_000_000).map('{:.1f}'.format) + 'B VND'
+    )
+
+    return "\n\n".join(blocks)
 
-def compare_and_notify():
+
+async def compare_and_notify():
     """Compare current screening with previous and send Telegram notification if changed"""
     print("\n" + "="*50)
     print(f"Running screening cycle at {datetime.now()}")
     print("="*50)
     
     # Get current qualified stocks
-    current_stocks = screen_stocks()
-    current_symbols = set(s['symbol'] for s in current_stocks)
-    
+    current_stocks, failed_symbols = screen_stocks()
+
     # Load previous state
     previous_state = load_previous_state()
     previous_stocks = previous_state['qualified_stocks']
-    previous_symbols = set(s['symbol'] for s in previous_stocks)
-    
-    # Find changes
-    newcomers = [s for s in current_stocks if s['symbol'] not in previous_symbols]
-    dropouts = [s for s in previous_stocks if s['symbol'] not in current_symbols]
+    previous_symbols = set(previous_stocks['symbol'])
+
+    # Symbols whose fetch failed keep their previous rows: missing data must
+    # not show up as a dropout alert
+    carried = previous_stocks[previous_stocks['symbol'].isin(failed_symbols)]
+    if len(carried) > 0:
+        current_stocks = (pd.concat([current_stocks, carried], ignore_index=True)
+                          .sort_values('symbol', ignore_index=True))
+
+    current_symbols = set(current_stocks['symbol'])
+
+    # Find changes with vectorized membership tests on the symbol columns
+    newcomers = current_stocks[~current_stocks['symbol'].isin(previous_symbols)]
+    dropouts = previous_stocks[~previous_stocks['symbol'].isin(current_symbols)]
     
     # Check if there are any changes
     has_changes = len(newcomers) > 0 or len(dropouts) > 0
-    
+
+    # Dedup against the last alert actually sent, keyed on what the alert
+    # would say (sorted symbols plus prices bucketed to 3 significant
+    # digits). If the state rows were lost or rolled back after a send, the
+    # replayed alert hashes the same and is skipped; cycles that send
+    # nothing leave the stored key untouched
+    alert_key = previous_state['alert_key']
+    if has_changes:
+        content = ','.join(current_stocks['symbol'] + ':'
+                           + current_stocks['price'].map('{:.3g}'.format))
+        new_key = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        if new_key == alert_key:
+            print("\n✓ Alert identical to the last one sent - not re-sending")
+            has_changes = False
+        else:
+            alert_key = new_key
+
     if has_changes:
         print("\n🔔 CHANGES DETECTED - Sending Telegram notification")
         
@@ -218,63 +624,64 @@ def compare_and_notify():
         message_parts.append("")
         
         # Newcomers (price went up)
-        if newcomers:
+        if len(newcomers) > 0:
             message_parts.append(f"📈 <b>Newcomers ({len(newcomers)})</b>")
             message_parts.append(format_stock_table(newcomers))
             message_parts.append("")
         
         # Dropouts (price went down)
-        if dropouts:
+        if len(dropouts) > 0:
             message_parts.append(f"📉 <b>Dropouts ({len(dropouts)})</b>")
             message_parts.append(format_stock_table(dropouts))
         
         message = "\n".join(message_parts)
         
         # Send to Telegram
-        send_telegram_message(message)
+        await send_telegram_message(message)
     else:
         print("\n✓ No changes detected - No notification sent")
     
     # Save current state
-    save_state(current_stocks)
+    save_state(current_stocks, alert_key)
     
     print(f"\nCurrent qualified: {len(current_stocks)} stocks")
     print(f"Newcomers: {len(newcomers)}")
     print(f"Dropouts: {len(dropouts)}")
 
 
+async def main_loop():
+    """Run a screening cycle, then sleep exactly until the next one is due"""
+    while True:
+        cycle_start = time.monotonic()
+        await compare_and_notify()
+
+        # Sleep straight to the next fire time instead of polling every minute
+        elapsed = time.monotonic() - cycle_start
+        await asyncio.sleep(max(0.0, SCREEN_INTERVAL - elapsed))
+
+
 def main():
     """Main function"""
     print("Vietnam Stock Screener - Telegram Bot")
     print("======================================")
-    
+
     # Check environment variables
     if not TELEGRAM_BOT_TOKEN:
         print("⚠️  TELEGRAM_BOT_TOKEN not set in environment variables")
     if not TELEGRAM_CHAT_ID:
         print("⚠️  TELEGRAM_CHAT_ID not set in environment variables")
-    
+
     print("\nTo set up:")
     print("1. Create a bot with @BotFather on Telegram")
     print("2. Get your chat ID from @userinfobot")
     print("3. Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID in Replit Secrets")
     print("")
-    
-    # Run immediately on startup
-    print("Running initial screening...")
-    compare_and_notify()
-    
-    # Schedule to run every 4 hours
-    schedule.every(4).hours.do(compare_and_notify)
-    
-    print("\n✓ Screener is now running!")
+
+    print("✓ Screener is now running!")
     print("📅 Scheduled to run every 4 hours")
     print("⌨️  Press Ctrl+C to stop\n")
-    
-    # Keep the script running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+
+    asyncio.run(main_loop())
 
 
 if __name__ == "__main__":